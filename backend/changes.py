@@ -0,0 +1,133 @@
+# ----------------------------------------------------------------------------#
+# Imports.
+# ----------------------------------------------------------------------------#
+import json
+import logging
+import select
+import threading
+import time
+from collections import deque
+
+
+# ----------------------------------------------------------------------------#
+# Change feed.
+# ----------------------------------------------------------------------------#
+CHANNEL = 'question_changes'
+SEQUENCE = 'question_changes_seq'
+BUFFER_SIZE = 1000
+# seconds between two attempts to reconnect the listener
+RECONNECT_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+'''
+ChangeFeed
+    bounded ring buffer of the latest changes of the question bank.
+    Each change is a dict with a 'seq' number (see models.py), which
+    clients send back to resume the feed where they left it, the
+    'type' of change and the 'id' of the question. The seq
+    numbers are taken in commit order (see lock_changes in models.py),
+    so they increase in the order the changes are appended.
+    'floor' is the last seq number that can no longer be replayed.
+'''
+class ChangeFeed:
+
+  def __init__(self, size=BUFFER_SIZE):
+    self.events = deque(maxlen=size)
+    self.floor = None
+    self.condition = threading.Condition()
+
+  def reset(self, floor):
+    with self.condition:
+      self.events.clear()
+      self.floor = floor
+      self.condition.notify_all()
+
+  def append(self, event):
+    with self.condition:
+      if len(self.events) == self.events.maxlen:
+        self.floor = self.events[0]['seq']
+      self.events.append(event)
+      self.condition.notify_all()
+
+  def last_seq(self):
+    with self.condition:
+      return self.events[-1]['seq'] if self.events else self.floor
+
+  def since(self, seq):
+    # returns the events following 'seq', and whether some of
+    # them can no longer be replayed (the client has to reload)
+    with self.condition:
+      missed = self.floor is None or seq < self.floor
+      return [e for e in self.events if e['seq'] > seq], missed
+
+  def wait(self, seq, timeout):
+    # blocks until an event following 'seq' is available (or until
+    # the feed is started if 'seq' is None), or 'timeout' seconds
+    # have passed
+    with self.condition:
+      if seq is None:
+        self.condition.wait_for(lambda: self.floor is not None, timeout)
+      else:
+        self.condition.wait_for(
+          lambda: self.events and self.events[-1]['seq'] > seq, timeout)
+
+
+question_changes = ChangeFeed()
+
+
+# ----------------------------------------------------------------------------#
+# Listener.
+# ----------------------------------------------------------------------------#
+# Changes are published with a postgres NOTIFY (see models.py), so
+# every worker process LISTENs to the channel and fills its own feed,
+# whichever worker made the change.
+_listener = None
+_listener_lock = threading.Lock()
+
+'''
+start_listener(engine)
+    starts (once per process) the thread filling 'question_changes'
+    from the notifications of the database bound to 'engine'
+'''
+def start_listener(engine):
+  global _listener
+  with _listener_lock:
+    if _listener is not None and _listener.is_alive():
+      return
+    _listener = threading.Thread(
+      target=_listen, args=(engine,), name='question-changes', daemon=True)
+    _listener.start()
+
+
+def _listen(engine):
+  while True:
+    try:
+      # detached from the pool, as it is kept LISTENing
+      connection = engine.raw_connection()
+      connection.detach()
+      try:
+        connection.set_isolation_level(0)  # autocommit
+        cursor = connection.cursor()
+        cursor.execute('LISTEN {}'.format(CHANNEL))
+        # changes committed before LISTEN cannot be replayed. The
+        # lock waits for the changes being committed (see lock_changes
+        # in models.py), whose notifications are received after LISTEN
+        cursor.execute('SELECT pg_advisory_lock(hashtext(%s))', (CHANNEL,))
+        cursor.execute(
+          'SELECT CASE WHEN is_called THEN last_value ELSE 0 END '
+          'FROM {}'.format(SEQUENCE))
+        question_changes.reset(cursor.fetchone()[0])
+        cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', (CHANNEL,))
+        while True:
+          if select.select([connection], [], [], 60) == ([], [], []):
+            continue
+          connection.poll()
+          while connection.notifies:
+            notify = connection.notifies.pop(0)
+            question_changes.append(json.loads(notify.payload))
+      finally:
+        connection.close()
+    except Exception:
+      logger.exception('question changes listener failed, reconnecting')
+      time.sleep(RECONNECT_DELAY)
@@ -0,0 +1,271 @@
+# ----------------------------------------------------------------------------#
+# Imports.
+# ----------------------------------------------------------------------------#
+import random
+import re
+import threading
+import zlib
+from collections import defaultdict
+from multiprocessing import Pool
+
+
+# ----------------------------------------------------------------------------#
+# MinHash signatures.
+# ----------------------------------------------------------------------------#
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+# estimated jaccard similarity above which two questions are similar
+# (trivia questions often differ by a single word, so they are only
+# duplicates when their answers are the same too, see same_answer)
+SIMILARITY_THRESHOLD = 0.7
+# jaccard similarity above which two answers are the same
+ANSWER_THRESHOLD = 0.5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# the hash coefficients are drawn from a fixed seed so that signatures
+# computed in different processes (see find_duplicate_clusters) agree
+_rng = random.Random(20200501)
+_PERMUTATIONS = [
+  (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+  for _ in range(NUM_PERMUTATIONS)]
+
+
+def _normalize(text):
+  return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+'''
+shingles(text)
+    returns the set of character shingles of the normalized text
+    (lower case, punctuation removed, whitespace collapsed)
+'''
+def shingles(text):
+  normalized = _normalize(text)
+  if len(normalized) <= SHINGLE_SIZE:
+    return {normalized}
+  return {normalized[i:i + SHINGLE_SIZE]
+          for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+'''
+signature(text)
+    returns the MinHash signature of the text, as a tuple
+    of NUM_PERMUTATIONS integers
+'''
+def signature(text):
+  hashed = [zlib.crc32(s.encode('utf-8')) for s in shingles(text)]
+  return tuple(
+    min((a * h + b) % _MERSENNE_PRIME for h in hashed) & _MAX_HASH
+    for a, b in _PERMUTATIONS)
+
+
+'''
+similarity(sig_a, sig_b)
+    estimated jaccard similarity of the texts behind two signatures
+'''
+def similarity(sig_a, sig_b):
+  same = sum(1 for a, b in zip(sig_a, sig_b) if a == b)
+  return same / NUM_PERMUTATIONS
+
+
+'''
+normalize_answer(answer)
+    returns the normalized answer, without its leading
+    article ('The Liver' and 'liver' are the same answer)
+'''
+def normalize_answer(answer):
+  return re.sub(r'^(the|a|an) ', '', _normalize(answer or ''))
+
+
+'''
+same_answer(answer_a, answer_b)
+    whether two answers (as returned by normalize_answer) are the
+    same: the words of one contain the words of the other ('Fleming'
+    and 'Alexander Fleming'), or their shingles are similar enough
+    ('Leonardo da Vinci' and 'Leonardo Da-Vinci')
+'''
+def same_answer(answer_a, answer_b):
+  if not answer_a or not answer_b:
+    return False
+  words_a, words_b = set(answer_a.split()), set(answer_b.split())
+  if words_a <= words_b or words_b <= words_a:
+    return True
+  shingles_a, shingles_b = shingles(answer_a), shingles(answer_b)
+  return (len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+          >= ANSWER_THRESHOLD)
+
+
+def _bands(sig):
+  # each band is keyed by its position so that equal rows in
+  # different bands do not land in the same bucket
+  return [(band, sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+          for band in range(NUM_BANDS)]
+
+
+def _signature_item(item):
+  question_id, text, answer = item
+  return question_id, signature(text)
+
+
+# ----------------------------------------------------------------------------#
+# LSH index.
+# ----------------------------------------------------------------------------#
+'''
+QuestionIndex
+    keeps the MinHash signature of every question in LSH buckets,
+    so that near-duplicates of a new question are found by looking
+    at NUM_BANDS buckets instead of scanning the questions table.
+    A question is a duplicate when both its text and its answer are
+    similar, and only similar when its text is. The index is loaded
+    from the database, then kept up to date with the change feed of
+    the question bank (see sync()).
+    It is shared by the threads of the process, hence the lock.
+'''
+class QuestionIndex:
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.loaded = False
+    self.seq = None
+    self.signatures = {}
+    self.answers = {}
+    self.buckets = defaultdict(set)
+
+  def sync(self, feed, load_items, load_questions):
+    # applies the changes of the feed (see changes.py) since the
+    # last sync, or (re)loads the index from 'load_items()' when
+    # some of them can no longer be replayed. The feed only has
+    # the ids of the changed questions, 'load_questions(ids)'
+    # returns the questions that still exist, by id.
+    with self.lock:
+      if self.loaded and self.seq is not None:
+        changes, missed = feed.since(self.seq)
+        if not missed:
+          questions = load_questions([change['id'] for change in changes
+                                      if change['type'] != 'delete'])
+          for change in changes:
+            self._apply(change, questions.get(change['id']))
+            self.seq = change['seq']
+          return
+      elif self.loaded and feed.last_seq() is None:
+        # the feed is not started yet: keep the index as loaded
+        return
+
+      # changes made while loading are replayed by the next sync
+      self.seq = feed.last_seq()
+      self.signatures.clear()
+      self.answers.clear()
+      self.buckets.clear()
+      for question_id, text, answer in load_items():
+        self._add(question_id, text, answer)
+      self.loaded = True
+
+  def add(self, question_id, text, answer):
+    with self.lock:
+      self._add(question_id, text, answer)
+
+  def remove(self, question_id):
+    with self.lock:
+      self._remove(question_id)
+
+  def find_duplicates(self, text, answer):
+    # returns the ids of the duplicates (similar text and same
+    # answer) and of the similar questions (similar text only)
+    sig = signature(text)
+    answer = normalize_answer(answer)
+    duplicate_ids, similar_ids = [], []
+    with self.lock:
+      candidates = set()
+      for band in _bands(sig):
+        candidates.update(self.buckets.get(band, ()))
+      for question_id in sorted(candidates):
+        if similarity(sig, self.signatures[question_id]) < SIMILARITY_THRESHOLD:
+          continue
+        if same_answer(answer, self.answers[question_id]):
+          duplicate_ids.append(question_id)
+        else:
+          similar_ids.append(question_id)
+    return duplicate_ids, similar_ids
+
+  def _apply(self, change, question):
+    if change['type'] == 'delete' or question is None:
+      self._remove(change['id'])
+    else:
+      self._add(question['id'], question['question'], question['answer'])
+
+  def _add(self, question_id, text, answer):
+    # a question without text is not indexed
+    self._remove(question_id)
+    if text is None:
+      return
+    sig = signature(text)
+    self.signatures[question_id] = sig
+    self.answers[question_id] = normalize_answer(answer)
+    for band in _bands(sig):
+      self.buckets[band].add(question_id)
+
+  def _remove(self, question_id):
+    sig = self.signatures.pop(question_id, None)
+    if sig is None:
+      return
+    del self.answers[question_id]
+    for band in _bands(sig):
+      self.buckets[band].discard(question_id)
+      if not self.buckets[band]:
+        del self.buckets[band]
+
+
+# ----------------------------------------------------------------------------#
+# Batch job.
+# ----------------------------------------------------------------------------#
+'''
+find_duplicate_clusters(items, processes=None)
+    takes a list of (question_id, question_text, answer) and returns
+    the clusters of near-duplicate questions, as sorted lists of ids.
+    Signatures are computed on a pool of 'processes' workers
+    (defaults to the number of CPUs).
+'''
+def find_duplicate_clusters(items, processes=None):
+  items = [(question_id, text, answer) for question_id, text, answer in items
+           if text is not None]
+  with Pool(processes) as pool:
+    signatures = dict(pool.map(_signature_item, items, chunksize=256))
+  answers = {question_id: normalize_answer(answer)
+             for question_id, text, answer in items}
+
+  buckets = defaultdict(list)
+  for question_id, sig in signatures.items():
+    for band in _bands(sig):
+      buckets[band].append(question_id)
+
+  # union-find over the candidate pairs that are similar enough
+  parent = {question_id: question_id for question_id in signatures}
+
+  def find(question_id):
+    while parent[question_id] != question_id:
+      parent[question_id] = parent[parent[question_id]]
+      question_id = parent[question_id]
+    return question_id
+
+  checked = set()
+  for bucket in buckets.values():
+    for i, id_a in enumerate(bucket):
+      for id_b in bucket[i + 1:]:
+        pair = (id_a, id_b) if id_a < id_b else (id_b, id_a)
+        if pair in checked:
+          continue
+        checked.add(pair)
+        if (similarity(signatures[id_a], signatures[id_b]) >= SIMILARITY_THRESHOLD
+            and same_answer(answers[id_a], answers[id_b])):
+          parent[find(id_a)] = find(id_b)
+
+  clusters = defaultdict(list)
+  for question_id in signatures:
+    clusters[find(question_id)].append(question_id)
+
+  return sorted(sorted(cluster) for cluster in clusters.values()
+                if len(cluster) > 1)
@@ -2,18 +2,28 @@
 # Imports.
 # ----------------------------------------------------------------------------#
 import os
-from flask import Flask, request, abort, jsonify
+import json
+from flask import (Flask, Response, request, abort, jsonify, send_from_directory,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import and_
 import random
+import click
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
+from dedup import QuestionIndex, find_duplicate_clusters
+from changes import question_changes, start_listener
+from profiling import (setup_profiling, profiling_enabled, has_profile_token,
+                       list_profiles, PROFILE_HEADER)
 
 
 # ----------------------------------------------------------------------------#
 # helper functions.
 # ----------------------------------------------------------------------------#
 QUESTIONS_PER_PAGE = 10
+# seconds between two keep-alive comments on the change feed
+KEEPALIVE_INTERVAL = 15
 
 # Helper method
 def paginate_questions(request, selection):
@@ -33,6 +43,41 @@ def paginate_questions(request, selection):
     
     return current_questions
 
+# Helper method
+def select_questions(body):
+    # builds the condition selecting the questions of a
+    # bulk operation, from a list of question 'ids' and/or
+    # a 'category' and/or a 'difficulty'. At least one of
+    # them is required, so that a bulk operation never
+    # applies to all the questions by mistake.
+    conditions = []
+    if body.get('ids') is not None:
+        if not isinstance(body['ids'], list):
+            raise ValueError('ids must be a list')
+        conditions.append(Question.id.in_([int(i) for i in body['ids']]))
+    if body.get('category') is not None:
+        conditions.append(Question.category == body['category'])
+    if body.get('difficulty') is not None:
+        conditions.append(Question.difficulty == int(body['difficulty']))
+
+    if len(conditions) == 0:
+        raise ValueError('no question selected')
+
+    return and_(*conditions)
+
+# Helper method
+def question_values(body, fields):
+    # returns the new values of the 'fields' of questions,
+    # as given in the request body
+    values = {field: body[field] for field in fields if field in body}
+    if 'difficulty' in values:
+        values['difficulty'] = int(values['difficulty'])
+
+    if len(values) == 0:
+        raise ValueError('no value to update')
+
+    return values
+
 
 
 # ----------------------------------------------------------------------------#
@@ -45,23 +90,51 @@ def create_app(test_config=None):
   # Configuration.
   # ----------------------------------------------------------------------------#
   app = Flask(__name__)
+  if test_config is not None:
+    app.config.update(test_config)
   # setup_db defined in XX
   setup_db(app)
+  # opt-in profiling of requests, defined in profiling.py
+  setup_profiling(app)
   # allow CORS for all routes and all domains (*)
   CORS(app)
   # which is equivalent to:
   # cors = CORS(app, resources={r"/*": {"origins": "*"}})
 
+  # index of the questions, used to reject near-duplicates
+  # when a question is posted. It is loaded from the database
+  # on first use, then kept up to date with the changes made
+  # by every worker (see load_question_index).
+  question_index = QuestionIndex()
+
+  def load_question_index():
+    start_listener(db.engine)
+    question_index.sync(
+      question_changes,
+      lambda: Question.query.with_entities(
+        Question.id, Question.question, Question.answer).all(),
+      load_questions)
+    return question_index
+
+  # the change feed only carries the ids of the changed
+  # questions: returns them by id (formatted), when they
+  # still exist
+  def load_questions(ids):
+    if len(ids) == 0:
+      return {}
+    questions = Question.query.filter(Question.id.in_(ids)).all()
+    return {question.id: question.format() for question in questions}
+
 
   # CORS Headers
   @app.after_request
   def after_request(response):
     response.headers.add(
       'Access-Control-Allow-Headers',
-      'Content-Type,Authorization,true')
+      'Content-Type,Authorization,{},true'.format(PROFILE_HEADER))
     response.headers.add(
       'Access-Control-Allow-Methods',
-      'GET,PUT,POST,DELETE,OPTIONS')
+      'GET,PUT,POST,PATCH,DELETE,OPTIONS')
     return response
 
 
@@ -129,6 +202,72 @@ def create_app(test_config=None):
       abort(422)
 
 
+  # Question bank changes.
+  # ----------------------------------------#
+  '''
+  Endpoint streaming (as Server-Sent Events) the questions 
+  inserted, updated and deleted, so that clients can apply 
+  the changes instead of reloading pages of questions. 
+  A client resumes the feed by sending the id of the last 
+  event received (Last-Event-ID header, or 'last_event_id' 
+  query parameter). If those events are no longer buffered, 
+  a 'reset' event tells the client to reload the questions.
+  '''
+  @app.route('/questions/changes')
+  def stream_question_changes():
+    try:
+      start_listener(db.engine)
+      seq = request.headers.get('Last-Event-ID',
+                                request.args.get('last_event_id'))
+      seq = int(seq) if seq is not None else None
+    except:
+      abort(422)
+
+    def events(seq):
+      while True:
+        if question_changes.last_seq() is None:
+          # the listener is not connected yet
+          question_changes.wait(None, KEEPALIVE_INTERVAL)
+          yield ': keep-alive\n\n'
+          continue
+
+        if seq is None:
+          # a new client only gets the changes following its connection
+          seq = question_changes.last_seq()
+
+        changes, missed = question_changes.since(seq)
+        if missed:
+          seq = question_changes.last_seq()
+          yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(seq)
+          continue
+
+        questions = load_questions(
+          [change['id'] for change in changes if change['type'] != 'delete'])
+        # the stream keeps no database connection between changes
+        db.session.remove()
+
+        for change in changes:
+          seq = change['seq']
+          if change['type'] == 'delete':
+            question = {'id': change['id']}
+          elif change['id'] in questions:
+            question = questions[change['id']]
+          else:
+            # deleted since, its 'delete' event follows
+            continue
+          yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+            seq, change['type'], json.dumps(question))
+
+        if not changes:
+          yield ': keep-alive\n\n'
+        question_changes.wait(seq, KEEPALIVE_INTERVAL)
+
+    return Response(stream_with_context(events(seq)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
   # Delete a question.
   # ----------------------------------------#
   '''
@@ -140,20 +279,148 @@ def create_app(test_config=None):
   @app.route('/questions/<int:question_id>', methods=['DELETE'])
   def delete_question(question_id):
     try:
-      question = Question.query.filter(Question.id == question_id).one_or_none()
+      # method defined in models.py
+      deleted = Question.bulk_delete(Question.id == question_id)
+    except:
+      abort(422)
+
+    if len(deleted) == 0:
+      abort(404)
 
-      question.delete() # method defined in models.py
-      selection = Question.query.all()
-      current_questions = paginate_questions(request, selection)
+    question_index.remove(question_id)
 
+    return jsonify({
+      'success': True,
+      'question_deleted_id': question_id,
+      'deleted': True
+    })
+
+
+  # Delete questions.
+  # ----------------------------------------#
+  '''
+  Endpoint to DELETE, in a single statement, the questions 
+  selected by a list of 'ids' and/or a 'category' and/or 
+  a 'difficulty'. 
+  '''
+  @app.route('/questions', methods=['DELETE'])
+  def delete_questions():
+    try:
+      body = request.get_json()
+
+      # method defined in models.py
+      deleted = Question.bulk_delete(select_questions(body))
+    except:
+      abort(422)
+
+    deleted_ids = [question['id'] for question in deleted]
+    for question_id in deleted_ids:
+      question_index.remove(question_id)
+
+    return jsonify({
+      'success': True,
+      'question_deleted_ids': deleted_ids,
+      'total_deleted': len(deleted_ids),
+      'deleted': True
+    })
+
+
+  # Update a question.
+  # ----------------------------------------#
+  '''
+  Endpoint to PATCH the question, answer, category 
+  and/or difficulty of a question using a question ID. 
+  As when posting a question, a question that is a 
+  near-duplicate of other questions is rejected (409), 
+  unless 'allow_duplicate' is true, and the ids of the 
+  similar questions are returned.
+  '''
+  @app.route('/questions/<int:question_id>', methods=['PATCH'])
+  def update_question(question_id):
+    try:
+      body = request.get_json()
+
+      values = question_values(
+        body, ['question', 'answer', 'category', 'difficulty'])
+
+      allow_duplicate = body.get('allow_duplicate', False)
+
+      duplicate_ids, similar_ids = [], []
+      if 'question' in values or 'answer' in values:
+        current = (Question.query
+                   .with_entities(Question.question, Question.answer)
+                   .filter(Question.id == question_id)
+                   .one_or_none())
+        new_question = values.get(
+          'question', current.question if current else None)
+        if new_question is not None:
+          found_duplicates, found_similar = load_question_index().find_duplicates(
+            new_question,
+            values.get('answer', current.answer if current else None))
+          # the question itself is not a duplicate
+          duplicate_ids = [i for i in found_duplicates if i != question_id]
+          similar_ids = [i for i in found_similar if i != question_id]
+    except:
+      abort(422)
+
+    if duplicate_ids and not allow_duplicate:
       return jsonify({
-        'success': True,
-        'question_deleted_id': question_id,
-        'deleted': True
-      })
+        'success': False,
+        'error': 409,
+        'message': 'duplicate question',
+        'duplicate_question_ids': duplicate_ids
+      }), 409
+
+    try:
+      # method defined in models.py
+      updated = Question.bulk_update(Question.id == question_id, values)
+    except:
+      abort(422)
+
+    if len(updated) == 0:
+      abort(404)
+
+    question_index.add(
+      question_id, updated[0]['question'], updated[0]['answer'])
+
+    return jsonify({
+      'success': True,
+      'question': updated[0],
+      'updated': True,
+      'duplicate_question_ids': sorted(duplicate_ids + similar_ids)
+    })
+
+
+  # Update questions.
+  # ----------------------------------------#
+  '''
+  Endpoint to PATCH, in a single statement, the category 
+  and/or difficulty ('update' values) of the questions 
+  selected by a list of 'ids' and/or a 'category' and/or 
+  a 'difficulty'. Answers are updated one question at a 
+  time, as they are checked for near-duplicates. 
+  '''
+  @app.route('/questions', methods=['PATCH'])
+  def update_questions():
+    try:
+      body = request.get_json()
+
+      values = question_values(body['update'], ['category', 'difficulty'])
+
+      # method defined in models.py
+      updated = Question.bulk_update(select_questions(body), values)
     except:
       abort(422)
 
+    updated_ids = [question['id'] for question in updated]
+
+    return jsonify({
+      'success': True,
+      'question_updated_ids': updated_ids,
+      'total_updated': len(updated_ids),
+      'updated': True
+    })
+
 
   # Post a new question.
   # ----------------------------------------#
@@ -165,6 +432,13 @@ def create_app(test_config=None):
   TEST: When you submit a question on the "Add" tab, 
   the form will clear and the question will appear at the end of the last page
   of the questions list in the "List" tab.  
+
+  A question that is a near-duplicate (e.g. reworded, with 
+  the same answer) of existing questions is rejected with a 
+  409 error, which returns the ids of those questions. It is 
+  created anyway if 'allow_duplicate' is true. The ids of the 
+  near-duplicates and of the similar questions (similar text, 
+  other answer) are returned with the created question id.
   '''
   @app.route('/questions', methods=['POST'])
   def post_question():
@@ -176,6 +450,22 @@ def create_app(test_config=None):
       new_difficulty = body.get('difficulty', None)
       new_category = body.get('category', None)
 
+      allow_duplicate = body.get('allow_duplicate', False)
+
+      duplicate_ids, similar_ids = load_question_index().find_duplicates(
+        new_question, new_answer)
+    except:
+      abort(422)
+
+    if duplicate_ids and not allow_duplicate:
+      return jsonify({
+        'success': False,
+        'error': 409,
+        'message': 'duplicate question',
+        'duplicate_question_ids': duplicate_ids
+      }), 409
+
+    try:
       question = Question(
         question=new_question,
         answer=new_answer,
@@ -183,17 +473,18 @@ def create_app(test_config=None):
         category=new_category)
 
       question.insert() # method defined in models.py
-      selection = Question.query.all()
-      current_questions = paginate_questions(request, selection)
-
-      return jsonify({
-        'success': True,
-        'created': True,
-        'created_question_id': question.id
-      })
     except:
       abort(422)
 
+    question_index.add(question.id, question.question, question.answer)
+
+    return jsonify({
+      'success': True,
+      'created': True,
+      'created_question_id': question.id,
+      'duplicate_question_ids': sorted(duplicate_ids + similar_ids)
+    })
+
 
   # Search questions.
   # ----------------------------------------#
@@ -353,6 +644,41 @@ def create_app(test_config=None):
 
 
 
+  # Profiles.
+  # ----------------------------------------#
+  '''
+  Admin endpoints to list the saved request profiles, and 
+  to download the pstats file of a profile. They require 
+  the PROFILE_TOKEN in the X-Profile-Token header, so 
+  they are forbidden when no PROFILE_TOKEN is configured.
+  '''
+  def check_profile_token():
+    if not profiling_enabled(app):
+      abort(404)
+    if not has_profile_token(app):
+      abort(403)
+
+  @app.route('/profiles')
+  def retrieve_profiles():
+    check_profile_token()
+    try:
+      profiles = list_profiles(app)
+
+      return jsonify({
+        'success': True,
+        'profiles': profiles,
+        'total_profiles': len(profiles)
+      })
+    except:
+      abort(422)
+
+  @app.route('/profiles/<name>')
+  def download_profile(name):
+    check_profile_token()
+    return send_from_directory(app.config['PROFILE_DIR'], name + '.pstats',
+                               as_attachment=True)
+
+
   # Error handlers.
   # ----------------------------------------#
   '''
@@ -367,6 +693,14 @@ def create_app(test_config=None):
       'message': 'bad request'
     }), 400
 
+  @app.errorhandler(403)
+  def forbidden(error):
+    return jsonify({
+      'success': False,
+      'error': 403,
+      'message': 'forbidden'
+    }), 403
+
   @app.errorhandler(404)
   def not_found(error):
     return jsonify({
@@ -392,6 +726,25 @@ def create_app(test_config=None):
     }), 422
 
 
+  # Commands.
+  # ----------------------------------------#
+  '''
+  Batch job listing the clusters of near-duplicate 
+  questions in the database:
+      flask find-duplicates --processes 4
+  '''
+  @app.cli.command('find-duplicates')
+  @click.option('--processes', default=None, type=int,
+                help='Number of worker processes (default: number of CPUs).')
+  def find_duplicates_command(processes):
+    items = Question.query.with_entities(
+      Question.id, Question.question, Question.answer).all()
+    clusters = find_duplicate_clusters(items, processes)
+    for cluster in clusters:
+      click.echo(' '.join(str(question_id) for question_id in cluster))
+    click.echo('{} duplicate cluster(s) found'.format(len(clusters)))
+
+
   return app
 
     
\ No newline at end of file
@@ -2,10 +2,13 @@
 # Imports.
 # ----------------------------------------------------------------------------#
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import (Column, String, Integer, Sequence, Text, create_engine,
+                        text, select, func, cast)
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from changes import CHANNEL, SEQUENCE
+
 # ----------------------------------------------------------------------------#
 # Database.
 # ----------------------------------------------------------------------------#
@@ -14,6 +17,9 @@ database_path = "postgres://{}/{}".format('localhost:5432', database_name)
 
 db = SQLAlchemy()
 
+# numbers the changes of the question bank (see changes.py)
+question_changes_seq = Sequence(SEQUENCE, metadata=db.metadata)
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -26,6 +32,40 @@ def setup_db(app, database_path=database_path):
     db.create_all()
 
 
+'''
+lock_changes()
+    serializes, until the end of the current transaction, the changes
+    of the question bank. It must be called before they are flushed
+    and published, so that the seq numbers of the changes (taken by
+    publish_change) follow the order of the commits, which is the
+    order in which the notifications reach the change feed.
+'''
+def lock_changes():
+    db.session.execute(
+      text("SELECT pg_advisory_xact_lock(hashtext(:channel))"),
+      {'channel': CHANNEL})
+
+
+'''
+publish_change(type, question)
+    notifies the change feed that 'question' was inserted, updated
+    or deleted. The notification is sent with the current transaction,
+    so it must be called before the commit (and after lock_changes).
+    It only carries the id of the question, as postgres limits the
+    size of notifications (8000 bytes): listeners load the question.
+'''
+def publish_change(type, question):
+    db.session.execute(
+      text("SELECT pg_notify(:channel, json_build_object("
+           "'seq', nextval(:sequence), 'type', :type, 'id', :id)::text)"),
+      {
+        'channel': CHANNEL,
+        'sequence': SEQUENCE,
+        'type': type,
+        'id': question.id
+      })
+
+
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
@@ -51,13 +91,22 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
+    lock_changes()
+    db.session.flush()
+    publish_change('insert', self)
     db.session.commit()
   
   def update(self):
+    lock_changes()
+    db.session.flush()
+    publish_change('update', self)
     db.session.commit()
 
   def delete(self):
     db.session.delete(self)
+    lock_changes()
+    db.session.flush()
+    publish_change('delete', self)
     db.session.commit()
 
   def format(self):
@@ -69,6 +118,47 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+  '''
+  bulk_update(condition, values)
+      updates, in a single UPDATE statement and transaction, the
+      questions matching 'condition' with the dict 'values'.
+      Returns the updated questions, formatted.
+  '''
+  @classmethod
+  def bulk_update(cls, condition, values):
+    statement = cls.__table__.update().where(condition).values(**values)
+    return cls._execute_changes('update', statement)
+
+  '''
+  bulk_delete(condition)
+      deletes, in a single DELETE statement and transaction, the
+      questions matching 'condition'.
+      Returns the deleted questions, formatted.
+  '''
+  @classmethod
+  def bulk_delete(cls, condition):
+    statement = cls.__table__.delete().where(condition)
+    return cls._execute_changes('delete', statement)
+
+  @classmethod
+  def _execute_changes(cls, type, statement):
+    # the change feed is notified of every changed question
+    # by the statement itself (see publish_change)
+    changed = statement.returning(*cls.__table__.columns).cte('changed')
+    notify = func.pg_notify(CHANNEL, cast(func.json_build_object(
+      'seq', func.nextval(SEQUENCE),
+      'type', type,
+      'id', changed.c.id), Text))
+    try:
+      lock_changes()
+      rows = db.session.execute(select([notify, *changed.c])).fetchall()
+      db.session.commit()
+    except:
+      db.session.rollback()
+      raise
+    return [{column.name: row[column.name] for column in cls.__table__.columns}
+            for row in rows]
+
 
 # Category.
 # ----------------------------------------#
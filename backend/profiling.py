@@ -0,0 +1,185 @@
+# ----------------------------------------------------------------------------#
+# Imports.
+# ----------------------------------------------------------------------------#
+import cProfile
+import hmac
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# ----------------------------------------------------------------------------#
+# Request profiling.
+# ----------------------------------------------------------------------------#
+PROFILE_HEADER = 'X-Profile-Token'
+# endpoints never profiled: the admin endpoints listing the profiles,
+# and the change feed, whose request lasts as long as the client stays
+UNPROFILED_ENDPOINTS = {
+  'retrieve_profiles', 'download_profile', 'stream_question_changes'}
+
+'''
+setup_profiling(app)
+    profiles (with cProfile, capturing the SQL statements) a
+    sampled fraction of the requests, and the requests carrying
+    the PROFILE_TOKEN in the X-Profile-Token header. Each profile
+    is saved in PROFILE_DIR as a .pstats file and a .json file
+    (route, duration, SQL statements). Configured with:
+        PROFILE_SAMPLE_RATE  fraction of requests profiled (default 0)
+        PROFILE_TOKEN        token authorizing profiling on demand
+        PROFILE_DIR          directory of the profiles
+        PROFILE_MAX_FILES    number of profiles kept (default 100),
+                             the oldest ones are deleted
+    Nothing is registered when profiling is off.
+'''
+def setup_profiling(app):
+  app.config.setdefault('PROFILE_SAMPLE_RATE',
+                        float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+  app.config.setdefault('PROFILE_TOKEN', os.environ.get('PROFILE_TOKEN'))
+  app.config.setdefault('PROFILE_DIR', os.environ.get(
+    'PROFILE_DIR', os.path.join(app.instance_path, 'profiles')))
+  app.config.setdefault('PROFILE_MAX_FILES',
+                        int(os.environ.get('PROFILE_MAX_FILES', 100)))
+
+  if not profiling_enabled(app):
+    return
+
+  os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+  _listen_sql()
+
+  @app.before_request
+  def start_profile():
+    if request.endpoint in UNPROFILED_ENDPOINTS:
+      return
+    requested = has_profile_token(app)
+    if not requested and random.random() >= app.config['PROFILE_SAMPLE_RATE']:
+      return
+    profiler = cProfile.Profile()
+    try:
+      profiler.enable()
+    except ValueError:
+      # another request of the process is being profiled
+      # (python >= 3.12 allows a single active profiler)
+      return
+    g.profile_sql = []
+    g.profile_start = time.perf_counter()
+    g.profiler = profiler
+
+  @app.teardown_request
+  def save_profile(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+      return
+    profiler.disable()
+    duration = time.perf_counter() - g.pop('profile_start')
+    statements = g.pop('profile_sql')
+
+    name = '{}-{}-{}'.format(
+      datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), os.getpid(),
+      request.endpoint)
+    path = os.path.join(app.config['PROFILE_DIR'], name)
+    profiler.dump_stats(path + '.pstats')
+    with open(path + '.json', 'w') as f:
+      json.dump({
+        'name': name,
+        'method': request.method,
+        'path': request.full_path,
+        'endpoint': request.endpoint,
+        'duration': duration,
+        'sql': statements
+      }, f, indent=2)
+
+    _delete_old_profiles(app)
+
+
+'''
+profiling_enabled(app)
+    whether requests of the app can be profiled
+'''
+def profiling_enabled(app):
+  return (app.config['PROFILE_SAMPLE_RATE'] > 0
+          or bool(app.config['PROFILE_TOKEN']))
+
+
+'''
+has_profile_token(app)
+    whether the current request carries the PROFILE_TOKEN (always
+    false when no token is configured)
+'''
+def has_profile_token(app):
+  token = app.config['PROFILE_TOKEN']
+  if not token:
+    return False
+  return hmac.compare_digest(
+    request.headers.get(PROFILE_HEADER, '').encode('utf-8'),
+    token.encode('utf-8'))
+
+
+'''
+list_profiles(app)
+    returns the metadata of the saved profiles, latest first
+'''
+def list_profiles(app):
+  directory = app.config['PROFILE_DIR']
+  if not os.path.isdir(directory):
+    return []
+  profiles = []
+  for file_name in sorted(os.listdir(directory), reverse=True):
+    if file_name.endswith('.json'):
+      with open(os.path.join(directory, file_name)) as f:
+        profile = json.load(f)
+      profiles.append({
+        'name': profile['name'],
+        'method': profile['method'],
+        'path': profile['path'],
+        'duration': profile['duration'],
+        'sql_statements': len(profile['sql'])
+      })
+  return profiles
+
+
+def _delete_old_profiles(app):
+  # keeps the PROFILE_MAX_FILES latest profiles (their names
+  # start with their date)
+  directory = app.config['PROFILE_DIR']
+  names = sorted(file_name[:-len('.json')]
+                 for file_name in os.listdir(directory)
+                 if file_name.endswith('.json'))
+  for name in names[:max(0, len(names) - app.config['PROFILE_MAX_FILES'])]:
+    for extension in ('.json', '.pstats'):
+      try:
+        os.remove(os.path.join(directory, name + extension))
+      except FileNotFoundError:
+        # deleted by another worker
+        pass
+
+
+_sql_listening = False
+
+def _listen_sql():
+  # listens to every engine once; statements are only
+  # recorded during the requests being profiled
+  global _sql_listening
+  if _sql_listening:
+    return
+  _sql_listening = True
+
+  @event.listens_for(Engine, 'before_cursor_execute')
+  def before_cursor_execute(conn, cursor, statement, parameters,
+                            context, executemany):
+    if has_app_context() and 'profile_sql' in g:
+      context._profile_start = time.perf_counter()
+
+  @event.listens_for(Engine, 'after_cursor_execute')
+  def after_cursor_execute(conn, cursor, statement, parameters,
+                           context, executemany):
+    if hasattr(context, '_profile_start') and 'profile_sql' in g:
+      g.profile_sql.append({
+        'statement': statement,
+        'duration': time.perf_counter() - context._profile_start
+      })
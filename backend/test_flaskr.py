@@ -2,11 +2,13 @@
 # Imports.
 # ----------------------------------------------------------------------------#
 import os
+import tempfile
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
+from changes import ChangeFeed, question_changes, start_listener
 
 
 # ----------------------------------------------------------------------------#
@@ -96,6 +98,68 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])                
         self.assertTrue(data['categories'])
 
+  # Test. [GET QUESTION CHANGES => OK ]
+  # ----------------------------------------#
+    def test_200_get_question_changes(self):
+        # Get response by making client make the GET request,
+        # without reading the (endless) event stream:
+        res = self.client().get('/questions/changes', buffered=False)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        res.close()
+
+  # Test. [POST QUESTIONS => IN CHANGE FEED ]
+  # ----------------------------------------#
+    def test_post_questions_reach_change_feed(self):
+        # Start the listener filling the change feed:
+        with self.app.app_context():
+            start_listener(db.engine)
+        question_changes.wait(None, 10)
+        seq = question_changes.last_seq()
+
+        # Post two questions:
+        created_ids = []
+        for question in ['Which question of the feed comes first?',
+                         'Who follows in the change feed tests?']:
+            res = self.client().post('/questions', json={
+                'question': question,
+                'answer': 'Me',
+                'difficulty': 1,
+                'category': 1
+                })
+            created_ids.append(json.loads(res.data)['created_question_id'])
+
+        # Wait for their notifications:
+        for _ in range(10):
+            changes, missed = question_changes.since(seq)
+            inserts = [change for change in changes
+                       if change['type'] == 'insert'
+                       and change['id'] in created_ids]
+            if len(inserts) == 2:
+                break
+            question_changes.wait(question_changes.last_seq(), 1)
+
+        # check the changes, in the order of the inserts:
+        self.assertFalse(missed)
+        self.assertEqual([change['id'] for change in inserts], created_ids)
+        self.assertLess(seq, inserts[0]['seq'])
+        self.assertLess(inserts[0]['seq'], inserts[1]['seq'])
+
+  # Test. [GET QUESTION CHANGES WITH WRONG EVENT ID => ERROR ]
+  # ----------------------------------------#
+    def test_422_get_question_changes_wrong_event_id(self):
+        # Get response by making client make the GET request:
+        res = self.client().get('/questions/changes?last_event_id=abc')
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
   # Test. [DELETE QUESTION id => OK ]
   # ----------------------------------------#    
     def test_200_delete_question(self):
@@ -111,12 +175,117 @@ class TriviaTestCase(unittest.TestCase):
 
   # Test. [DELETE NON-EXISTENT QUESTION => ERROR ]
   # ----------------------------------------#    
-    def test_422_delete_nonexistent_question(self):
+    def test_404_delete_nonexistent_question(self):
         # Get response by making client make the GET request:
         res = self.client().delete('/questions/2000')
         # Load the data using json.loads:
         data = json.loads(res.data)
 
+        # check responses:
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+  # Test. [DELETE QUESTIONS BY ids => OK ]
+  # ----------------------------------------#
+    def test_200_delete_questions(self):
+        # Get response by making client make the DELETE request:
+        res = self.client().delete('/questions', json={'ids': [4, 6]})
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], True)
+        self.assertEqual(sorted(data['question_deleted_ids']), [4, 6])
+        self.assertEqual(data['total_deleted'], 2)
+
+  # Test. [DELETE QUESTIONS WITHOUT SELECTION => ERROR ]
+  # ----------------------------------------#
+    def test_422_delete_questions_without_selection(self):
+        # Get response by making client make the DELETE request,
+        # without any question selected:
+        res = self.client().delete('/questions', json={})
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+  # Test. [DELETE QUESTIONS WITH ids NOT A LIST => ERROR ]
+  # ----------------------------------------#
+    def test_422_delete_questions_ids_not_list(self):
+        # Get response by making client make the DELETE request,
+        # with a string instead of a list of ids:
+        res = self.client().delete('/questions', json={'ids': '12'})
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+  # Test. [UPDATE QUESTION id => OK ]
+  # ----------------------------------------#
+    def test_200_update_question(self):
+        # Get response by making client make the PATCH request:
+        res = self.client().patch('/questions/21', json={'difficulty': 2})
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['updated'], True)
+        self.assertEqual(data['question']['id'], 21)
+        self.assertEqual(data['question']['difficulty'], 2)
+
+  # Test. [UPDATE NON-EXISTENT QUESTION => ERROR ]
+  # ----------------------------------------#
+    def test_404_update_nonexistent_question(self):
+        # Get response by making client make the PATCH request:
+        res = self.client().patch('/questions/2000', json={'difficulty': 2})
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+  # Test. [UPDATE QUESTIONS BY CATEGORY => OK ]
+  # ----------------------------------------#
+    def test_200_update_questions(self):
+        # Get response by making client make the PATCH request:
+        res = self.client().patch('/questions', json={
+            'category': 6,
+            'update': {'difficulty': 3}
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['updated'], True)
+        self.assertEqual(sorted(data['question_updated_ids']), [10, 11])
+
+  # Test. [UPDATE ANSWER OF QUESTIONS => ERROR ]
+  # ----------------------------------------#
+    def test_422_update_questions_answer(self):
+        # Get response by making client make the PATCH request,
+        # updating the answer of many questions at once:
+        res = self.client().patch('/questions', json={
+            'category': 6,
+            'update': {'answer': 'Brazil'}
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
         # check responses:
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data['success'], False)
@@ -136,6 +305,26 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['created'], True)
 
+  # Test. [POST QUESTION LONGER THAN A NOTIFICATION => OK ]
+  # ----------------------------------------#
+    def test_200_post_long_question(self):
+        # Get response by making client make the POST request,
+        # with a question longer than the 8000 bytes postgres
+        # allows in a notification of the change feed:
+        res = self.client().post('/questions', json={
+            'question': 'Which long question ' + 'goes on and on ' * 600 + '?',
+            'answer': 'This one',
+            'difficulty': 5,
+            'category': 5
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], True)
+
   # Test. [POST QUESTION WITH NO INFO => ERROR ]
   # ----------------------------------------#    
     def test_422_post_wrong_question_info(self):
@@ -150,6 +339,112 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unprocessable')
 
+  # Test. [POST NEAR-DUPLICATE QUESTION => ERROR ]
+  # ----------------------------------------#
+    def test_409_post_duplicate_question(self):
+        # Get response by making client make the
+        # POST request, with a reworded existing question:
+        res = self.client().post('/questions', json={
+            'question': 'what is the heaviest organ of the human body',
+            'answer': 'The Liver',
+            'difficulty': 4,
+            'category': 1
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'duplicate question')
+        self.assertIn(20, data['duplicate_question_ids'])
+
+  # Test. [POST SAME QUESTION WITH SHORTER ANSWER => ERROR ]
+  # ----------------------------------------#
+    def test_409_post_duplicate_question_shorter_answer(self):
+        # Get response by making client make the POST request,
+        # with an existing question, whose answer is worded
+        # differently ('Alexander Fleming' in the database):
+        res = self.client().post('/questions', json={
+            'question': 'Who discovered penicillin?',
+            'answer': 'Fleming',
+            'difficulty': 3,
+            'category': 1
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertIn(21, data['duplicate_question_ids'])
+
+  # Test. [POST ONE-WORD VARIANT WITH OTHER ANSWER => OK ]
+  # ----------------------------------------#
+    def test_200_post_one_word_variant_question(self):
+        # Get response by making client make the POST request,
+        # with an existing question differing by one word, whose
+        # answer differs too (it is only flagged as similar):
+        res = self.client().post('/questions', json={
+            'question': 'What is the largest lake in Asia?',
+            'answer': 'Caspian Sea',
+            'difficulty': 2,
+            'category': 3
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], True)
+        self.assertIn(13, data['duplicate_question_ids'])
+
+  # Test. [POST ALLOWED NEAR-DUPLICATE QUESTION => OK ]
+  # ----------------------------------------#
+    def test_200_post_allowed_duplicate_question(self):
+        # Get response by making client make the POST request,
+        # with a reworded existing question explicitly allowed:
+        res = self.client().post('/questions', json={
+            'question': 'Which is the heaviest organ in the human body?',
+            'answer': 'Liver',
+            'difficulty': 4,
+            'category': 1,
+            'allow_duplicate': True
+            })
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], True)
+        self.assertIn(20, data['duplicate_question_ids'])
+
+  # Test. [FIND DUPLICATES COMMAND => CLUSTERS ]
+  # ----------------------------------------#
+    def test_find_duplicates_command(self):
+        # Add a duplicate of the question 20:
+        res = self.client().post('/questions', json={
+            'question': 'What is the heaviest organ of the human body?',
+            'answer': 'Liver',
+            'difficulty': 4,
+            'category': 1,
+            'allow_duplicate': True
+            })
+        created_id = json.loads(res.data)['created_question_id']
+
+        # Run the command on the question bank:
+        result = self.app.test_cli_runner().invoke(
+            args=['find-duplicates', '--processes', '2'])
+        clusters = [line.split() for line in result.output.splitlines()[:-1]]
+
+        # check the command output:
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(any('20' in cluster and str(created_id) in cluster
+                            for cluster in clusters))
+        self.assertIn('duplicate cluster(s) found', result.output)
+
   # Test. [SEARCH QUESTION => OK ]
   # ----------------------------------------#    
     def test_200_search_question(self):
@@ -238,6 +533,200 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unprocessable')
 
+  # Test. [PROFILED REQUEST => OK ]
+  # ----------------------------------------#
+    def test_200_get_profiles(self):
+        # Create an app profiling the requests with the token:
+        app = create_app({
+            'PROFILE_TOKEN': 'secret',
+            'PROFILE_DIR': tempfile.mkdtemp()
+            })
+        setup_db(app, self.database_path)
+        headers = {'X-Profile-Token': 'secret'}
+
+        # Make a profiled request, then list the profiles:
+        app.test_client().get('/categories', headers=headers)
+        res = app.test_client().get('/profiles', headers=headers)
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_profiles'], 1)
+        self.assertTrue(data['profiles'][0]['sql_statements'])
+
+  # Test. [PROFILES BEYOND PROFILE_MAX_FILES => DELETED ]
+  # ----------------------------------------#
+    def test_200_get_profiles_max_files(self):
+        # Create an app keeping 2 profiles:
+        app = create_app({
+            'PROFILE_TOKEN': 'secret',
+            'PROFILE_DIR': tempfile.mkdtemp(),
+            'PROFILE_MAX_FILES': 2
+            })
+        setup_db(app, self.database_path)
+        headers = {'X-Profile-Token': 'secret'}
+
+        # Make 3 profiled requests, then list the profiles
+        # (twice, as listing the profiles is not profiled):
+        for url in ['/categories', '/questions', '/categories/1/questions']:
+            app.test_client().get(url, headers=headers)
+        app.test_client().get('/profiles', headers=headers)
+        res = app.test_client().get('/profiles', headers=headers)
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_profiles'], 2)
+        self.assertEqual(
+            sorted(profile['path'] for profile in data['profiles']),
+            ['/categories/1/questions?', '/questions?'])
+
+  # Test. [GET PROFILES WITHOUT TOKEN => ERROR ]
+  # ----------------------------------------#
+    def test_403_get_profiles_without_token(self):
+        # Create an app profiling the requests with the token:
+        app = create_app({
+            'PROFILE_TOKEN': 'secret',
+            'PROFILE_DIR': tempfile.mkdtemp()
+            })
+        setup_db(app, self.database_path)
+
+        # Get response by making client make the GET request:
+        res = app.test_client().get('/profiles')
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'forbidden')
+
+  # Test. [GET PROFILES WITHOUT CONFIGURED TOKEN => ERROR ]
+  # ----------------------------------------#
+    def test_403_get_profiles_without_configured_token(self):
+        # Create an app profiling the requests by sampling only:
+        app = create_app({
+            'PROFILE_SAMPLE_RATE': 1.0,
+            'PROFILE_DIR': tempfile.mkdtemp()
+            })
+        setup_db(app, self.database_path)
+
+        # Get response by making client make the GET request:
+        res = app.test_client().get('/profiles')
+        # Load the data using json.loads:
+        data = json.loads(res.data)
+
+        # check responses:
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'forbidden')
+
+# ----------------------------------------------------------------------------#
+# Change Feed Test Class.
+# ----------------------------------------------------------------------------#
+class ChangeFeedTestCase(unittest.TestCase):
+    """This class represents the change feed (ring buffer) test case"""
+
+
+    # Setup.
+    # ----------------------------------------#
+    def setUp(self):
+        """Define a small feed, started after the change 10."""
+        self.feed = ChangeFeed(size=3)
+        self.feed.reset(10)
+
+    def append(self, seq):
+        self.feed.append({'seq': seq, 'type': 'insert', 'id': seq})
+
+  # Test. [FEED NOT STARTED => RESET ]
+  # ----------------------------------------#
+    def test_not_started_feed(self):
+        feed = ChangeFeed()
+
+        changes, missed = feed.since(0)
+
+        # check the client has to reload:
+        self.assertEqual(feed.last_seq(), None)
+        self.assertEqual(changes, [])
+        self.assertTrue(missed)
+
+  # Test. [RESUME => CHANGES FOLLOWING Last-Event-ID ]
+  # ----------------------------------------#
+    def test_resume(self):
+        for seq in [11, 12, 13]:
+            self.append(seq)
+
+        changes, missed = self.feed.since(11)
+
+        # check the changes following 11 are replayed:
+        self.assertEqual([change['seq'] for change in changes], [12, 13])
+        self.assertFalse(missed)
+        self.assertEqual(self.feed.last_seq(), 13)
+
+  # Test. [RESUME FROM THE FLOOR => ALL CHANGES ]
+  # ----------------------------------------#
+    def test_resume_from_floor(self):
+        self.append(11)
+
+        changes, missed = self.feed.since(10)
+
+        # check every buffered change is replayed:
+        self.assertEqual([change['seq'] for change in changes], [11])
+        self.assertFalse(missed)
+
+  # Test. [RESUME BEFORE THE FEED STARTED => RESET ]
+  # ----------------------------------------#
+    def test_resume_before_start(self):
+        self.append(11)
+
+        changes, missed = self.feed.since(9)
+
+        # check the client has to reload (change 10 is missed):
+        self.assertTrue(missed)
+
+  # Test. [BUFFER FULL => OLDEST CHANGES EVICTED ]
+  # ----------------------------------------#
+    def test_eviction(self):
+        for seq in [11, 12, 13, 14, 15]:
+            self.append(seq)
+
+        # check the 3 latest changes are kept, and the
+        # floor is the last evicted change:
+        self.assertEqual(self.feed.floor, 12)
+        self.assertEqual([change['seq'] for change in self.feed.since(12)[0]],
+                         [13, 14, 15])
+        self.assertFalse(self.feed.since(12)[1])
+        # check a client at an evicted change has to reload:
+        self.assertTrue(self.feed.since(11)[1])
+
+  # Test. [LISTENER RECONNECTED => RESET ]
+  # ----------------------------------------#
+    def test_reset(self):
+        for seq in [11, 12]:
+            self.append(seq)
+
+        self.feed.reset(20)
+
+        # check the buffered changes are dropped, and the
+        # clients before the new floor have to reload:
+        self.assertEqual(self.feed.last_seq(), 20)
+        self.assertTrue(self.feed.since(12)[1])
+        self.assertEqual(self.feed.since(20), ([], False))
+
+  # Test. [WAIT => RETURNS ON NEW CHANGE ]
+  # ----------------------------------------#
+    def test_wait(self):
+        self.append(11)
+
+        # check waiting for a change already there returns at once,
+        # and waiting for a new change times out:
+        self.feed.wait(10, 5)
+        self.feed.wait(11, 0.01)
+        self.assertEqual(self.feed.since(11), ([], False))
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -14,11 +14,76 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      searched: false,
     }
+    // ids of the questions already removed from the view, as a
+    // deletion is seen both by the DELETE request and the change feed
+    this.removedIds = new Set();
   }
 
   componentDidMount() {
     this.getQuestions();
+    this.watchChanges();
+  }
+
+  componentWillUnmount() {
+    this.changes.close();
+  }
+
+  // Whether a question belongs to the displayed list (all the
+  // questions, or the questions of a category). Search results
+  // cannot be matched locally.
+  inCurrentView = (question) => {
+    const category = this.state.currentCategory;
+    return !this.state.searched
+      && (category === "" || category === null || `${category}` === `${question.category}`);
+  }
+
+  removeQuestion = (question) => {
+    if (this.removedIds.has(question.id)) {
+      return;
+    }
+    this.removedIds.add(question.id);
+    const shown = this.state.questions.some((q) => q.id === question.id);
+    if (shown || this.inCurrentView(question)) {
+      this.setState({
+        questions: this.state.questions.filter((q) => q.id !== question.id),
+        totalQuestions: this.state.totalQuestions - 1 })
+    }
+  }
+
+  // Apply the changes of the question bank to the displayed
+  // questions, instead of reloading the page of questions.
+  watchChanges = () => {
+    this.changes = new EventSource('/questions/changes');
+    this.changes.addEventListener('insert', (event) => {
+      const question = JSON.parse(event.data);
+      if (!this.inCurrentView(question)) {
+        return;
+      }
+      // new questions are only shown at the end of the last
+      // page of all the questions
+      const category = this.state.currentCategory;
+      const lastPage = Math.max(1, Math.ceil(this.state.totalQuestions / 10));
+      const shown = (category === "" || category === null)
+        && this.state.page === lastPage
+        && this.state.questions.length < 10;
+      this.setState({
+        questions: shown ? [...this.state.questions, question] : this.state.questions,
+        totalQuestions: this.state.totalQuestions + 1 })
+    });
+    this.changes.addEventListener('update', (event) => {
+      const question = JSON.parse(event.data);
+      this.setState({
+        questions: this.state.questions.map((q) => q.id === question.id ? question : q) })
+    });
+    this.changes.addEventListener('delete', (event) => {
+      this.removeQuestion(JSON.parse(event.data));
+    });
+    // the missed changes are no longer available
+    this.changes.addEventListener('reset', (event) => {
+      this.getQuestions();
+    });
   }
 
   getQuestions = () => {
@@ -30,7 +95,8 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           categories: result.categories,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searched: false })
         return;
       },
       error: (error) => {
@@ -66,7 +132,8 @@ class QuestionView extends Component {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searched: false })
         return;
       },
       error: (error) => {
@@ -91,7 +158,8 @@ class QuestionView extends Component {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searched: true })
         return;
       },
       error: (error) => {
@@ -108,7 +176,7 @@ class QuestionView extends Component {
           url: `/questions/${id}`, //TODO: update request URL
           type: "DELETE",
           success: (result) => {
-            this.getQuestions();
+            this.removeQuestion({id: id});
           },
           error: (error) => {
             alert('Unable to load questions. Please try your request again')